@@ -1,25 +1,184 @@
+import asyncio
+import atexit
 import os
 import time
 from pathlib import Path
 
-import pandas as pd
-import psycopg2
-from neo4j import GraphDatabase
-
-CHUNK_SIZE = 100  # how many rows to send to Neo4j per batch
+import psycopg
+from neo4j import AsyncGraphDatabase, GraphDatabase, unit_of_work
+
+CHUNK_SIZE = 10_000  # how many rows to send to Neo4j per batch (one UNWIND transaction)
+# Server-side limit for one batch transaction, in seconds (replaces PERIODIC COMMIT)
+TX_TIMEOUT = float(os.environ.get("NEO4J_TX_TIMEOUT", "300"))
+WAIT_DELAY_MIN = 0.1  # first retry delay of wait_for_*, doubled after each failure
+WAIT_DELAY_MAX = 1.6  # upper bound for that delay
+N_WORKERS = int(os.environ.get("ETL_WORKERS", "4"))  # concurrent Neo4j import workers
+APOC_BATCH_SIZE = 1_000  # inner transaction size of apoc.periodic.iterate loads
+
+_DRIVER = None  # shared Neo4j driver, created lazily by get_neo4j_driver()
+
+
+# ---------- Cypher load queries ----------
+# Kept constant so Neo4j can reuse its cached query plans across batches.
+# Each batch arrives column-wise (see stream_batches): $cols maps a column
+# name to the list of its values and $size is the number of rows, so row i
+# is read as $cols.<column>[i].
+
+# Category nodes
+CATEGORY_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MERGE (c:Category {id: $cols.id[i]})
+SET c.name = $cols.name[i]
+"""
+
+# Customer nodes
+CUSTOMER_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MERGE (c:Customer {id: $cols.id[i]})
+SET c.name = $cols.name[i],
+    c.join_date = $cols.join_date[i]
+"""
+
+# Product nodes
+PRODUCT_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MERGE (p:Product {id: $cols.id[i]})
+SET p.name = $cols.name[i],
+    p.price = $cols.price[i]
+"""
+
+# Order nodes
+ORDER_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MERGE (o:Order {id: $cols.id[i]})
+SET o.ts = datetime({epochSeconds: $cols.ts[i]})
+"""
+
+# IN_CATEGORY relationships (Product)-[:IN_CATEGORY]->(Category)
+IN_CATEGORY_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MATCH (p:Product {id: $cols.id[i]})
+MATCH (c:Category {id: $cols.category_id[i]})
+MERGE (p)-[:IN_CATEGORY]->(c)
+"""
+
+# PLACED relationships (Customer)-[:PLACED]->(Order)
+PLACED_CYPHER = """
+UNWIND range(0, $size - 1) AS i
+MATCH (o:Order {id: $cols.id[i]})
+MATCH (c:Customer {id: $cols.customer_id[i]})
+MERGE (c)-[:PLACED]->(o)
+"""
+
+# The CONTAINS and event loads dominate the row count. Their per-row
+# statement is kept on its own so it can also be handed to
+# apoc.periodic.iterate (see APOC_ITERATE_CYPHER).
+ROWS_UNWIND = "UNWIND range(0, $size - 1) AS i\n"
+
+# CONTAINS relationships (Order)-[:CONTAINS {quantity}]->(Product)
+CONTAINS_ACTION = """
+MATCH (o:Order {id: $cols.order_id[i]})
+MATCH (p:Product {id: $cols.product_id[i]})
+MERGE (o)-[r:CONTAINS]->(p)
+SET r.quantity = $cols.quantity[i]
+"""
+CONTAINS_CYPHER = ROWS_UNWIND + CONTAINS_ACTION
+
+# (:Customer)-[:VIEWED]->(:Product)
+VIEWED_ACTION = """
+MATCH (c:Customer {id: $cols.customer_id[i]})
+MATCH (p:Product {id: $cols.product_id[i]})
+MERGE (c)-[r:VIEWED {id: $cols.id[i]}]->(p)
+SET r.ts = datetime({epochSeconds: $cols.ts[i]})
+"""
+VIEWED_CYPHER = ROWS_UNWIND + VIEWED_ACTION
+
+# (:Customer)-[:CLICKED]->(:Product)
+CLICKED_ACTION = """
+MATCH (c:Customer {id: $cols.customer_id[i]})
+MATCH (p:Product {id: $cols.product_id[i]})
+MERGE (c)-[r:CLICKED {id: $cols.id[i]}]->(p)
+SET r.ts = datetime({epochSeconds: $cols.ts[i]})
+"""
+CLICKED_CYPHER = ROWS_UNWIND + CLICKED_ACTION
+
+# (:Customer)-[:ADDED_TO_CART]->(:Product)
+ADDED_TO_CART_ACTION = """
+MATCH (c:Customer {id: $cols.customer_id[i]})
+MATCH (p:Product {id: $cols.product_id[i]})
+MERGE (c)-[r:ADDED_TO_CART {id: $cols.id[i]}]->(p)
+SET r.ts = datetime({epochSeconds: $cols.ts[i]})
+"""
+ADDED_TO_CART_CYPHER = ROWS_UNWIND + ADDED_TO_CART_ACTION
+
+# Runs one batch through apoc.periodic.iterate: $iterate yields the row
+# indexes, $action is one of the *_ACTION statements above. Both are
+# parameters, so this query text never changes.
+# A relationship MERGE locks both end nodes, and a failed inner batch is
+# raised through apoc.util.validate as a ClientError, which execute_write
+# does not retry. So nothing may write these relationships concurrently:
+# parallel is false, and etl() gives the APOC loads their own phase with a
+# single worker (one outer batch at a time).
+APOC_ITERATE_CYPHER = f"""
+CALL apoc.periodic.iterate(
+    $iterate,
+    $action,
+    {{
+        batchSize: {APOC_BATCH_SIZE}, parallel: false, retries: 3,
+        params: {{size: $size, cols: $cols}}
+    }}
+)
+YIELD failedOperations, errorMessages
+CALL apoc.util.validate(
+    failedOperations > 0, "apoc.periodic.iterate failed: %s", [errorMessages]
+)
+"""
+
+
+def apoc_batches(action, batches):
+    """
+    Adds the apoc.periodic.iterate statements to each batch of a load,
+    so it can be written with APOC_ITERATE_CYPHER.
+    """
+    statements = {"iterate": ROWS_UNWIND + "RETURN i", "action": action}
+    for batch in batches:
+        yield {**batch, **statements}
 
 
 # ---------- Low-level connection helpers ----------
 
 def get_neo4j_driver():
+    """
+    Returns the process-wide Neo4j driver, creating it on first use.
+    The driver holds a connection pool, so reusing it avoids a new
+    TCP connect + Bolt handshake + auth for every query.
+    """
+    global _DRIVER
+    if _DRIVER is None:
+        uri, auth = _neo4j_settings()
+        _DRIVER = GraphDatabase.driver(uri, auth=auth)
+        atexit.register(_DRIVER.close)
+    return _DRIVER
+
+
+def get_async_neo4j_driver():
+    """
+    Returns a new asyncio Neo4j driver for the concurrent LOAD phase.
+    It must be created and closed inside the running event loop.
+    """
+    uri, auth = _neo4j_settings()
+    return AsyncGraphDatabase.driver(uri, auth=auth)
+
+
+def _neo4j_settings():
     uri = os.environ.get("NEO4J_URI", "bolt://neo4j:7687")
     user = os.environ.get("NEO4J_USER", "neo4j")
     password = os.environ.get("NEO4J_PASSWORD", "password")
-    return GraphDatabase.driver(uri, auth=(user, password))
+    return uri, (user, password)
 
 
 def get_postgres_connection():
-    return psycopg2.connect(
+    return psycopg.connect(
         host=os.environ.get("POSTGRES_HOST", "postgres"),
         dbname=os.environ.get("POSTGRES_DB", "shop"),
         user=os.environ.get("POSTGRES_USER", "app"),
@@ -29,35 +188,116 @@ def get_postgres_connection():
 
 # ---------- Functions required by the assignment ----------
 
-def run_cypher(query, params=None):
+def run_cypher(query, params=None, session=None):
     """
     Executes a single Cypher query against Neo4j.
     `params` is a dict passed as query parameters.
+    If `session` is given it is reused, otherwise a short-lived session
+    is opened on the shared driver.
     """
-    driver = get_neo4j_driver()
-    try:
-        with driver.session() as session:
-            result = session.run(query, **(params or {}))
-            # Materialize result so connection can close cleanly
-            return list(result)
-    finally:
-        driver.close()
+    if session is not None:
+        return session.run(query, parameters=params).data()
+    with get_neo4j_driver().session() as s:
+        return s.run(query, parameters=params).data()
+
 
+def run_cypher_write(query, params=None, session=None):
+    """
+    Executes a write-only Cypher query and returns its ResultSummary.
+    Records are discarded instead of being buffered as in run_cypher.
+    """
+    if session is not None:
+        return session.run(query, parameters=params).consume()
+    with get_neo4j_driver().session() as s:
+        return s.run(query, parameters=params).consume()
 
-def run_cypher_file(path: Path):
+
+def iter_statements(text):
+    """
+    Yields the Cypher statements found in `text`, in a single pass.
+    Statements end at a top-level ';'. Semicolons inside '...', "..." or
+    `...` and inside // or /* */ comments are ignored, comments are
+    dropped, and empty statements are skipped.
+    """
+    state = "code"  # code | sq_str | dq_str | backtick | line_cmt | block_cmt
+    buf = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        nxt = text[i + 1] if i + 1 < n else ""
+        if state == "code":
+            if ch == ";":
+                stmt = "".join(buf).strip()
+                if stmt:
+                    yield stmt
+                buf = []
+                i += 1
+                continue
+            if ch == "/" and nxt in ("/", "*"):
+                state = "line_cmt" if nxt == "/" else "block_cmt"
+                i += 2
+                continue
+            if ch == "'":
+                state = "sq_str"
+            elif ch == '"':
+                state = "dq_str"
+            elif ch == "`":
+                state = "backtick"
+        elif state in ("sq_str", "dq_str"):
+            if ch == "\\":
+                # Keep the escaped character, whatever it is
+                buf.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == ("'" if state == "sq_str" else '"'):
+                state = "code"
+        elif state == "backtick":
+            if ch == "`":
+                state = "code"
+        elif state == "line_cmt":
+            if ch == "\n":
+                state = "code"
+                buf.append(ch)
+            i += 1
+            continue
+        else:  # block_cmt
+            if ch == "*" and nxt == "/":
+                state = "code"
+                buf.append(" ")
+                i += 2
+            else:
+                i += 1
+            continue
+        buf.append(ch)
+        i += 1
+
+    stmt = "".join(buf).strip()
+    if stmt:
+        yield stmt
+
+
+def run_cypher_file(path: Path, session=None):
     """
     Executes all Cypher statements found in a .cypher file.
-    Statements are assumed to be separated by ';'.
+    Statements are separated by ';' (see iter_statements).
     Used here to apply schema (constraints, indexes, etc.).
     """
     with path.open("r", encoding="utf-8") as f:
         content = f.read()
 
-    # Split on ';' and remove empty pieces
-    statements = [s.strip() for s in content.split(";") if s.strip()]
+    for stmt in iter_statements(content):
+        run_cypher_write(stmt, session=session)
+
 
-    for stmt in statements:
-        run_cypher(stmt)
+def apoc_available(session):
+    """
+    Returns True if the APOC plugin is installed on the Neo4j server.
+    """
+    record = session.run(
+        "SHOW PROCEDURES YIELD name WHERE name = 'apoc.periodic.iterate' "
+        "RETURN count(*) > 0 AS available"
+    ).single()
+    return record["available"]
 
 
 def chunk(items, size):
@@ -69,32 +309,150 @@ def chunk(items, size):
         yield items[i:i + size]
 
 
+def stream_batches(name, sql, size=CHUNK_SIZE, params=None):
+    """
+    Runs `sql` on a named (server-side) cursor and yields the result in
+    batches of <= size rows, as the query parameters of one load:
+    {"size": number of rows, "cols": {column name: list of values}}.
+    Postgres keeps the result set, so only one batch is held in memory.
+    Rows travel in the binary protocol and arrive as native Python types.
+    Sending columns instead of one map per row means Bolt packs each
+    column name once per batch rather than once per row.
+    Each call uses its own connection, so several tables can be read at once.
+    """
+    with get_postgres_connection() as conn, conn.cursor(name=name, binary=True) as cur:
+        cur.itersize = size
+        cur.execute(sql, params)
+        columns = [col.name for col in cur.description]
+        while rows := cur.fetchmany(size):
+            yield {
+                "size": len(rows),
+                "cols": dict(zip(columns, map(list, zip(*rows)))),
+            }
+
+
+@unit_of_work(timeout=TX_TIMEOUT)
+async def _write_batch(tx, query, batch):
+    result = await tx.run(query, parameters=batch)
+    await result.consume()
+
+
+async def import_worker(driver, queue, errors):
+    """
+    Consumes (query, batch) pairs from `queue` and writes each batch
+    in its own write transaction. The first failure is recorded in
+    `errors`; later batches are then drained without being written.
+    """
+    while True:
+        query, batch = await queue.get()
+        try:
+            if not errors:
+                async with driver.session() as session:
+                    await session.execute_write(_write_batch, query, batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            queue.task_done()
+
+
+async def produce(queue, query, batches, errors):
+    """
+    Feeds every batch of one load into `queue`.
+    Batches are fetched in a thread, off the event loop, so Postgres reads
+    overlap with each other and with the workers' Neo4j writes.
+    Stops reading as soon as a worker has recorded an error in `errors`.
+    """
+    batches = iter(batches)
+    fetch = None
+    try:
+        while not errors:
+            # Shielded so cancelling the producer never abandons a running fetch
+            fetch = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            batch = await asyncio.shield(fetch)
+            if batch is None:
+                break
+            await queue.put((query, batch))
+    finally:
+        # The generator cannot be closed while a thread is still inside it
+        if fetch is not None and not fetch.done():
+            await asyncio.gather(fetch, return_exceptions=True)
+        # Release the cursor and connection of a load stopped early
+        if hasattr(batches, "close"):
+            batches.close()
+
+
+async def load_phase(driver, loads, n_workers):
+    """
+    Reads all (query, batches) `loads` in parallel and writes their
+    batches with `n_workers` concurrent workers.
+    """
+    # Bounded queue: producers never get far ahead of the workers
+    queue = asyncio.Queue(maxsize=n_workers * 2)
+    errors = []
+    workers = [
+        asyncio.create_task(import_worker(driver, queue, errors))
+        for _ in range(n_workers)
+    ]
+    producers = [
+        asyncio.create_task(produce(queue, query, batches, errors))
+        for query, batches in loads
+    ]
+    try:
+        await asyncio.gather(*producers)
+        await queue.join()
+        if errors:
+            raise errors[0]
+    finally:
+        # Producers first: one failed read must not leave the others
+        # running (and holding Postgres connections) without workers
+        tasks = producers + workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def load_phases(phases):
+    """
+    Loads data into Neo4j phase by phase.
+    `phases` is a list of (n_workers, loads) pairs, where `loads` is a list
+    of (query, batches) pairs. A phase only starts once the previous one is
+    fully written, so nodes exist before the relationships that MATCH them.
+    """
+    async with get_async_neo4j_driver() as driver:
+        for n_workers, loads in phases:
+            await load_phase(driver, loads, n_workers)
+
+
 def wait_for_neo4j(timeout=60):
     """
     Repeatedly tries to connect to Neo4j until it is ready or timeout expires.
     This is important in docker-compose where services start in parallel.
+    Retries back off exponentially and probe through the shared driver.
     """
     start = time.time()
+    delay = WAIT_DELAY_MIN
     while True:
         try:
-            driver = get_neo4j_driver()
-            driver.verify_connectivity()
-            driver.close()
+            # Reuse the shared driver; closing it here would break later calls
+            get_neo4j_driver().verify_connectivity()
             print("Neo4j is ready")
             return
         except Exception as e:
             if time.time() - start > timeout:
-                raise RuntimeError("Neo4j not ready after {timeout}s") from e
+                raise RuntimeError(f"Neo4j not ready after {timeout}s") from e
             print("Waiting for Neo4j...", e)
-            time.sleep(2)
+            time.sleep(delay)
+            delay = min(delay * 2, WAIT_DELAY_MAX)
 
 
 def wait_for_postgres(timeout=60):
     """
     Repeatedly tries to connect to Postgres until it is ready or timeout expires.
     Avoids 'connection refused' errors when ETL starts too early.
+    Retries back off exponentially, as in wait_for_neo4j.
     """
     start = time.time()
+    delay = WAIT_DELAY_MIN
     while True:
         try:
             conn = get_postgres_connection()
@@ -103,9 +461,10 @@ def wait_for_postgres(timeout=60):
             return
         except Exception as e:
             if time.time() - start > timeout:
-                raise RuntimeError("Postgres not ready after {timeout}s") from e
+                raise RuntimeError(f"Postgres not ready after {timeout}s") from e
             print("Waiting for Postgres...", e)
-            time.sleep(2)
+            time.sleep(delay)
+            delay = min(delay * 2, WAIT_DELAY_MAX)
 
 
 # ---------- Main ETL ----------
@@ -127,168 +486,117 @@ def etl():
 
     # Apply Neo4j schema (constraints / indexes) from queries.cypher
     queries_path = Path(__file__).with_name("queries.cypher")
-    if queries_path.exists():
-        run_cypher_file(queries_path)
-
-    # ---------- EXTRACT from Postgres ----------
+    with get_neo4j_driver().session() as session:
+        if queries_path.exists():
+            run_cypher_file(queries_path, session=session)
+        use_apoc = apoc_available(session)
+
+    # ---------- EXTRACT from Postgres, LOAD into Neo4j ----------
+    # Rows are streamed from server-side cursors straight into the UNWIND
+    # batches, so no table is ever fully held in memory. Each load reads
+    # from its own connection, in parallel with the others of its phase.
+
+    # Events are filtered by type in Postgres, one query per relationship type
+    # Timestamps are sent as whole epoch seconds (one int8, truncated like the
+    # former to_char format) and rebuilt by Neo4j
+    events_sql = """
+        SELECT id, customer_id, product_id, floor(EXTRACT(EPOCH FROM ts))::bigint AS ts
+        FROM events
+        WHERE event_type = %s
+    """
 
-    conn = get_postgres_connection()
-    try:
-        customers_df = pd.read_sql(
-            "SELECT id, name, join_date::text AS join_date FROM customers", conn
-        )
-        categories_df = pd.read_sql(
-            "SELECT id, name FROM categories", conn
-        )
-        products_df = pd.read_sql(
-            "SELECT id, name, price, category_id FROM products", conn
-        )
-        orders_df = pd.read_sql(
-            """
-            SELECT 
-                id, 
-                customer_id, 
-                to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS') AS ts
-            FROM orders
-            """,
-            conn,
-        )
-        order_items_df = pd.read_sql(
-            "SELECT order_id, product_id, quantity FROM order_items", conn
-        )
-        events_df = pd.read_sql(
-            """
-            SELECT 
-                id, 
-                customer_id, 
-                product_id, 
-                event_type, 
-                to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS') AS ts
-            FROM events
-            """,
-            conn,
-        )
-    finally:
-        conn.close()
-
-    # Convert pandas DataFrames to plain Python lists of dicts
-    customers = customers_df.to_dict("records")
-    categories = categories_df.to_dict("records")
-    products = products_df.to_dict("records")
-    orders = orders_df.to_dict("records")
-    order_items = order_items_df.to_dict("records")
-    events = events_df.to_dict("records")
-
-    # ---------- LOAD into Neo4j (graph structure) ----------
-
-    # 1) Category nodes
-    for rows in chunk(categories, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MERGE (c:Category {id: row.id})
-            SET c.name = row.name
-            """,
-            {"rows": rows},
-        )
-
-    # 2) Product nodes + IN_CATEGORY relationships
-    for rows in chunk(products, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MERGE (p:Product {id: row.id})
-            SET p.name = row.name,
-                p.price = row.price
-            WITH p, row
-            MATCH (c:Category {id: row.category_id})
-            MERGE (p)-[:IN_CATEGORY]->(c)
-            """,
-            {"rows": rows},
-        )
-
-    # 3) Customer nodes
-    for rows in chunk(customers, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MERGE (c:Customer {id: row.id})
-            SET c.name = row.name,
-                c.join_date = date(row.join_date)
-            """,
-            {"rows": rows},
-        )
-
-    # 4) Order nodes + PLACED relationships (Customer)-[:PLACED]->(Order)
-    for rows in chunk(orders, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MERGE (o:Order {id: row.id})
-            SET o.ts = datetime(row.ts)
-            WITH o, row
-            MATCH (c:Customer {id: row.customer_id})
-            MERGE (c)-[:PLACED]->(o)
-            """,
-            {"rows": rows},
-        )
-
-    # 5) CONTAINS relationships (Order)-[:CONTAINS {quantity}]->(Product)
-    for rows in chunk(order_items, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MATCH (o:Order {id: row.order_id})
-            MATCH (p:Product {id: row.product_id})
-            MERGE (o)-[r:CONTAINS]->(p)
-            SET r.quantity = row.quantity
-            """,
-            {"rows": rows},
-        )
-
-    # 6) Event relationships: VIEWED / CLICKED / ADDED_TO_CART
-    view_events = [e for e in events if e["event_type"] == "view"]
-    click_events = [e for e in events if e["event_type"] == "click"]
-    add_events = [e for e in events if e["event_type"] == "add_to_cart"]
-
-    # (:Customer)-[:VIEWED]->(:Product)
-    for rows in chunk(view_events, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MATCH (c:Customer {id: row.customer_id})
-            MATCH (p:Product {id: row.product_id})
-            MERGE (c)-[r:VIEWED {id: row.id}]->(p)
-            SET r.ts = datetime(row.ts)
-            """,
-            {"rows": rows},
-        )
-
-    # (:Customer)-[:CLICKED]->(:Product)
-    for rows in chunk(click_events, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MATCH (c:Customer {id: row.customer_id})
-            MATCH (p:Product {id: row.product_id})
-            MERGE (c)-[r:CLICKED {id: row.id}]->(p)
-            SET r.ts = datetime(row.ts)
-            """,
-            {"rows": rows},
-        )
-
-    # (:Customer)-[:ADDED_TO_CART]->(:Product)
-    for rows in chunk(add_events, CHUNK_SIZE):
-        run_cypher(
-            """
-            UNWIND $rows AS row
-            MATCH (c:Customer {id: row.customer_id})
-            MATCH (p:Product {id: row.product_id})
-            MERGE (c)-[r:ADDED_TO_CART {id: row.id}]->(p)
-            SET r.ts = datetime(row.ts)
-            """,
-            {"rows": rows},
-        )
+    # Nodes and relationships are loaded in separate passes: every node
+    # exists before any relationship MATCHes it, and each UNWIND query
+    # stays a single simple plan.
+    node_loads = [
+        (
+            CATEGORY_CYPHER,
+            stream_batches("etl_categories", "SELECT id, name FROM categories"),
+        ),
+        (
+            CUSTOMER_CYPHER,
+            stream_batches("etl_customers", "SELECT id, name, join_date FROM customers"),
+        ),
+        (
+            PRODUCT_CYPHER,
+            stream_batches(
+                "etl_products",
+                # NUMERIC comes back as Decimal, which Bolt cannot send
+                "SELECT id, name, price::float8 AS price FROM products",
+            ),
+        ),
+        (
+            ORDER_CYPHER,
+            stream_batches(
+                "etl_orders",
+                "SELECT id, floor(EXTRACT(EPOCH FROM ts))::bigint AS ts FROM orders",
+            ),
+        ),
+    ]
+    relationship_loads = [
+        (
+            IN_CATEGORY_CYPHER,
+            stream_batches("etl_product_categories", "SELECT id, category_id FROM products"),
+        ),
+        (
+            PLACED_CYPHER,
+            stream_batches("etl_order_customers", "SELECT id, customer_id FROM orders"),
+        ),
+    ]
+    # CONTAINS and event relationships dominate the row count:
+    # (query, APOC action, batches)
+    heavy_loads = [
+        (
+            CONTAINS_CYPHER,
+            CONTAINS_ACTION,
+            stream_batches(
+                "etl_order_items",
+                "SELECT order_id, product_id, quantity FROM order_items",
+            ),
+        ),
+        (
+            VIEWED_CYPHER,
+            VIEWED_ACTION,
+            stream_batches("etl_view_events", events_sql, params=("view",)),
+        ),
+        (
+            CLICKED_CYPHER,
+            CLICKED_ACTION,
+            stream_batches("etl_click_events", events_sql, params=("click",)),
+        ),
+        (
+            ADDED_TO_CART_CYPHER,
+            ADDED_TO_CART_ACTION,
+            stream_batches("etl_add_events", events_sql, params=("add_to_cart",)),
+        ),
+    ]
+
+    if use_apoc:
+        # APOC commits each batch in APOC_BATCH_SIZE inner transactions that
+        # execute_write cannot retry, so these loads get their own phase and
+        # one worker: no two transactions compete for the same node locks.
+        phases = [
+            (N_WORKERS, node_loads),
+            (N_WORKERS, relationship_loads),
+            (
+                1,
+                [
+                    (APOC_ITERATE_CYPHER, apoc_batches(action, batches))
+                    for _, action, batches in heavy_loads
+                ],
+            ),
+        ]
+    else:
+        # Plain UNWIND batches may run concurrently: a deadlock between them
+        # is a transient error that execute_write retries.
+        phases = [
+            (N_WORKERS, node_loads),
+            (
+                N_WORKERS,
+                relationship_loads + [(query, batches) for query, _, batches in heavy_loads],
+            ),
+        ]
+    asyncio.run(load_phases(phases))
 
     print("ETL done.")
 